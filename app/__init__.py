@@ -1,10 +1,37 @@
+import atexit
 import logging
+import os
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 
 from flask import Flask
+from flask.logging import default_handler
 
+from .circuit_breaker import webhook_breaker
 from .config import Config
 from .database import init_engine, init_db, db_session
+from .group_commit import writer
 from .routes import api_bp, pages_bp
+from .timing import init_request_timing
+
+
+_log_listener: QueueListener | None = None
+
+
+def _start_log_listener(queue_handler: QueueHandler, handler: logging.Handler) -> None:
+    global _log_listener
+    # A fresh queue per process keeps records enqueued before a fork from being
+    # written twice, and the listener thread does not survive the fork anyway.
+    queue_handler.queue = SimpleQueue()
+    _log_listener = QueueListener(
+        queue_handler.queue, handler, respect_handler_level=True
+    )
+    _log_listener.start()
+
+
+def _stop_log_listener() -> None:
+    if _log_listener is not None:
+        _log_listener.stop()
 
 
 def _configure_logging(app: Flask) -> None:
@@ -12,15 +39,23 @@ def _configure_logging(app: Flask) -> None:
     app.logger.setLevel(log_level)
     app.logger.propagate = True
 
-    has_stream_handler = any(
-        isinstance(handler, logging.StreamHandler) for handler in app.logger.handlers
+    has_queue_handler = any(
+        isinstance(handler, QueueHandler) for handler in app.logger.handlers
     )
-    if not has_stream_handler:
+    if not has_queue_handler:
+        # Request threads only enqueue records; a listener thread does the I/O.
+        app.logger.removeHandler(default_handler)
         handler = logging.StreamHandler()
         handler.setFormatter(
             logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
         )
-        app.logger.addHandler(handler)
+        queue_handler = QueueHandler(SimpleQueue())
+        app.logger.addHandler(queue_handler)
+        _start_log_listener(queue_handler, handler)
+        os.register_at_fork(
+            after_in_child=lambda: _start_log_listener(queue_handler, handler)
+        )
+        atexit.register(_stop_log_listener)
 
     for logger_name in ("gunicorn.error", "gunicorn.access"):
         logging.getLogger(logger_name).setLevel(log_level)
@@ -40,6 +75,25 @@ def create_app(config_class: type[Config] | None = None) -> Flask:
     init_engine(app.config["DATABASE_URL"])
     init_db()
 
+    writer.configure(
+        enabled=app.config["GROUP_COMMIT_ENABLED"],
+        interval_ms=app.config["GROUP_COMMIT_INTERVAL_MS"],
+        max_batch=app.config["GROUP_COMMIT_MAX_BATCH"],
+        timeout_ms=app.config["GROUP_COMMIT_TIMEOUT_MS"],
+    )
+
+    webhook_breaker.configure(
+        failure_rate_threshold=app.config["WEBHOOK_BREAKER_FAILURE_RATE"],
+        slow_call_rate_threshold=app.config["WEBHOOK_BREAKER_SLOW_CALL_RATE"],
+        slow_call_ms=app.config["WEBHOOK_BREAKER_SLOW_CALL_MS"],
+        min_calls=app.config["WEBHOOK_BREAKER_MIN_CALLS"],
+        window_seconds=app.config["WEBHOOK_BREAKER_WINDOW_SECONDS"],
+        open_seconds=app.config["WEBHOOK_BREAKER_OPEN_SECONDS"],
+        half_open_max_calls=app.config["WEBHOOK_BREAKER_HALF_OPEN_CALLS"],
+    )
+
+    init_request_timing(app)
+
     app.register_blueprint(api_bp)
     app.register_blueprint(pages_bp)
 
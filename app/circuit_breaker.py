@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class Permit:
+    """Handed out by :meth:`CircuitBreaker.allow_request` for one call.
+
+    Outcomes are only counted while the breaker is still in the state (and
+    generation) that admitted the call, so a slow call started before a trip
+    can never stand in for a half-open probe.
+    """
+
+    __slots__ = ("probe", "generation")
+
+    def __init__(self, probe: bool, generation: int) -> None:
+        self.probe = probe
+        self.generation = generation
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker shared by all request threads of a worker.
+
+    Outcomes are tracked over a sliding time window. Once at least
+    ``min_calls`` were seen, the breaker opens when the failure rate or the
+    slow-call rate reaches its threshold. After ``open_seconds`` it lets up to
+    ``half_open_max_calls`` probes through; a healthy probe closes it again,
+    a failed or slow one re-opens it.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.failure_rate_threshold = 0.5
+        self.slow_call_rate_threshold = 0.5
+        self.slow_call_seconds = 2.0
+        self.min_calls = 10
+        self.window_seconds = 30.0
+        self.open_seconds = 15.0
+        self.half_open_max_calls = 1
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._generation = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        # (finished_at, failed, slow) per call inside the window.
+        self._calls: deque[tuple[float, bool, bool]] = deque()
+        self._rejected = 0
+
+    def configure(
+        self,
+        *,
+        failure_rate_threshold: float,
+        slow_call_rate_threshold: float,
+        slow_call_ms: float,
+        min_calls: int,
+        window_seconds: float,
+        open_seconds: float,
+        half_open_max_calls: int,
+    ) -> None:
+        with self._lock:
+            self.failure_rate_threshold = failure_rate_threshold
+            self.slow_call_rate_threshold = slow_call_rate_threshold
+            self.slow_call_seconds = max(slow_call_ms, 0) / 1000.0
+            self.min_calls = max(min_calls, 1)
+            self.window_seconds = window_seconds
+            self.open_seconds = open_seconds
+            self.half_open_max_calls = max(half_open_max_calls, 1)
+
+    def allow_request(self) -> Permit | None:
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self._state == CLOSED:
+                return Permit(False, self._generation)
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_max_calls:
+                self._probes_in_flight += 1
+                return Permit(True, self._generation)
+            self._rejected += 1
+            return None
+
+    def record_success(self, permit: Permit, elapsed: float) -> None:
+        self._record(permit, failed=False, elapsed=elapsed)
+
+    def record_failure(self, permit: Permit, elapsed: float) -> None:
+        self._record(permit, failed=True, elapsed=elapsed)
+
+    def _record(self, permit: Permit, *, failed: bool, elapsed: float) -> None:
+        slow = elapsed >= self.slow_call_seconds
+        with self._lock:
+            if permit.generation != self._generation:
+                # Admitted before the last state change; its outcome is stale.
+                return
+            now = time.monotonic()
+            if permit.probe:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                if failed or slow:
+                    self._trip(now)
+                else:
+                    self._transition(CLOSED)
+                return
+
+            self._calls.append((now, failed, slow))
+            self._evict(now)
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            if (
+                failures / total >= self.failure_rate_threshold
+                or slow_calls / total >= self.slow_call_rate_threshold
+            ):
+                self._trip(now)
+
+    def _transition(self, state: str) -> None:
+        self._state = state
+        self._generation += 1
+        self._probes_in_flight = 0
+        self._calls.clear()
+
+    def _trip(self, now: float) -> None:
+        self._transition(OPEN)
+        self._opened_at = now
+
+    def _evict(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            total = len(self._calls)
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            retry_in = None
+            if self._state == OPEN:
+                retry_in = round(max(self.open_seconds - (now - self._opened_at), 0.0), 1)
+            return {
+                "name": self.name,
+                "state": self._state,
+                "window_calls": total,
+                "window_failures": failures,
+                "window_slow_calls": slow_calls,
+                "rejected_calls": self._rejected,
+                "retry_in_seconds": retry_in,
+            }
+
+
+webhook_breaker = CircuitBreaker("external_webhook")
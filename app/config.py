@@ -26,6 +26,18 @@ class Config:
         "CLIENT_API_KEY", "webhook-api-key-placeholder"
     )
     AUTO_REPLY_MODE = os.getenv("AUTO_REPLY_MODE", "disabled")
+    GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "false").lower() == "true"
+    GROUP_COMMIT_INTERVAL_MS = float(os.getenv("GROUP_COMMIT_INTERVAL_MS", "5"))
+    GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "100"))
+    GROUP_COMMIT_TIMEOUT_MS = float(os.getenv("GROUP_COMMIT_TIMEOUT_MS", "5000"))
+    WEBHOOK_LATENCY_BUDGET_MS = float(os.getenv("WEBHOOK_LATENCY_BUDGET_MS", "3000"))
+    WEBHOOK_BREAKER_FAILURE_RATE = float(os.getenv("WEBHOOK_BREAKER_FAILURE_RATE", "0.5"))
+    WEBHOOK_BREAKER_SLOW_CALL_RATE = float(os.getenv("WEBHOOK_BREAKER_SLOW_CALL_RATE", "0.5"))
+    WEBHOOK_BREAKER_SLOW_CALL_MS = float(os.getenv("WEBHOOK_BREAKER_SLOW_CALL_MS", "2000"))
+    WEBHOOK_BREAKER_MIN_CALLS = int(os.getenv("WEBHOOK_BREAKER_MIN_CALLS", "10"))
+    WEBHOOK_BREAKER_WINDOW_SECONDS = float(os.getenv("WEBHOOK_BREAKER_WINDOW_SECONDS", "30"))
+    WEBHOOK_BREAKER_OPEN_SECONDS = float(os.getenv("WEBHOOK_BREAKER_OPEN_SECONDS", "15"))
+    WEBHOOK_BREAKER_HALF_OPEN_CALLS = int(os.getenv("WEBHOOK_BREAKER_HALF_OPEN_CALLS", "1"))
     DEBUG = os.getenv("FLASK_DEBUG", "false").lower() == "true"
 
 
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from queue import Empty, Queue
+from typing import Any, Sequence
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as SQLAlchemyTimeoutError
+
+from .database import SessionLocal
+from .session_summary import record_batch_activity
+from .sse import broker
+
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+CLAIMED = "claimed"
+ABANDONED = "abandoned"
+
+
+class _PendingWrite:
+    """A unit of records that must be committed together."""
+
+    __slots__ = (
+        "records",
+        "vendor_id",
+        "room_name",
+        "result",
+        "committed",
+        "error",
+        "done",
+        "_state",
+        "_state_lock",
+    )
+
+    def __init__(
+        self,
+        records: Sequence[Any],
+        vendor_id: str | None = None,
+        room_name: str | None = None,
+    ) -> None:
+        self.records = list(records)
+        self.vendor_id = vendor_id
+        self.room_name = room_name
+        self.result: list[dict[str, Any]] = []
+        self.committed = False
+        self.error: BaseException | None = None
+        self.done = threading.Event()
+        self._state = QUEUED
+        self._state_lock = threading.Lock()
+
+    def claim(self) -> bool:
+        """Called by the writer; False if the waiter already gave up."""
+        with self._state_lock:
+            if self._state == ABANDONED:
+                return False
+            self._state = CLAIMED
+            return True
+
+    def abandon(self) -> bool:
+        """Called by the waiter; False if the writer is already committing it."""
+        with self._state_lock:
+            if self._state == CLAIMED:
+                return False
+            self._state = ABANDONED
+            return True
+
+
+class GroupCommitWriter:
+    """Write-behind stage that batches inserts from many request threads.
+
+    Request threads hand over their records and block until the batch they
+    joined has been committed. A single background thread per process drains
+    the queue every ``interval`` seconds (or as soon as ``max_batch`` units are
+    waiting), commits everything in one transaction and only then publishes
+    the stored messages to the SSE broker.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.interval = 0.005
+        self.max_batch = 100
+        self.timeout = 5.0
+        self._queue: Queue[_PendingWrite] = Queue()
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        *,
+        enabled: bool,
+        interval_ms: float,
+        max_batch: int,
+        timeout_ms: float,
+    ) -> None:
+        self.enabled = enabled
+        self.interval = max(interval_ms, 0) / 1000.0
+        self.max_batch = max(max_batch, 1)
+        self.timeout = max(timeout_ms, 1) / 1000.0
+
+    def submit(
+        self,
+        records: Sequence[Any],
+        *,
+        vendor_id: str | None = None,
+        room_name: str | None = None,
+    ) -> list[dict[str, Any]]:
+        pending = _PendingWrite(records, vendor_id, room_name)
+        self._ensure_worker()
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            if pending.abandon():
+                # Never picked up by the writer, so it will never be written
+                # and the client may safely retry.
+                raise SQLAlchemyTimeoutError(
+                    f"Group commit did not start within {self.timeout:.1f}s"
+                )
+            # Already part of a commit in flight: its outcome decides whether
+            # the rows exist, so give it one more interval before failing.
+            if not pending.done.wait(self.timeout):
+                raise SQLAlchemyTimeoutError(
+                    f"Group commit did not complete within {2 * self.timeout:.1f}s"
+                )
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _ensure_worker(self) -> None:
+        # With ``preload_app`` the writer is created in the gunicorn master, so
+        # each forked worker has to start its own thread and queue.
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._queue = Queue()
+            self._pid = pid
+            self._thread = threading.Thread(
+                target=self._run, name="group-commit-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        queue = self._queue
+        while True:
+            batch = [queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(queue.get(timeout=remaining))
+                except Empty:
+                    break
+            batch = [pending for pending in batch if pending.claim()]
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: list[_PendingWrite]) -> None:
+        try:
+            try:
+                self._commit(batch)
+            except SQLAlchemyError:
+                if len(batch) == 1:
+                    raise
+                logger.exception(
+                    "Group commit of %s writes failed; retrying individually",
+                    len(batch),
+                )
+                for pending in batch:
+                    try:
+                        self._commit([pending])
+                    except SQLAlchemyError as exc:
+                        pending.error = exc
+        except Exception as exc:  # noqa: BLE001 - waiters must always be released
+            logger.exception("Group commit failed")
+            for pending in batch:
+                if not pending.committed and pending.error is None:
+                    pending.error = exc
+
+        for pending in batch:
+            if pending.error is None:
+                for message in pending.result:
+                    # User messages were never pushed over SSE; keep it that way.
+                    if not message.get("is_from_user"):
+                        broker.publish(message)
+            pending.done.set()
+
+    @staticmethod
+    def _commit(batch: list[_PendingWrite]) -> None:
+        with SessionLocal(expire_on_commit=False) as session:
+            for pending in batch:
+                session.add_all(pending.records)
+            session.flush()
+            record_batch_activity(
+                session,
+                [
+                    (pending.records, pending.vendor_id, pending.room_name)
+                    for pending in batch
+                ],
+            )
+            session.commit()
+        for pending in batch:
+            pending.committed = True
+            pending.result = [record.to_dict() for record in pending.records]
+
+
+writer = GroupCommitWriter()
@@ -3,7 +3,7 @@ from __future__ import annotations
 import uuid
 from datetime import datetime, timezone
 
-from sqlalchemy import Boolean, Column, DateTime, Index, String, Text
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, String, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.types import TypeDecorator
 
@@ -64,4 +64,43 @@ class ChatMessage(Base):
             "message": self.message,
             "is_from_user": self.is_from_user,
             "created_at": self.created_at.isoformat() if self.created_at else None,
-        }
\ No newline at end of file
+        }
+
+
+class ChatSession(Base):
+    """Per-session summary kept in step with ``chat_messages`` on every insert."""
+
+    __tablename__ = "chat_sessions"
+
+    session_id = Column(String(255), primary_key=True)
+    message_count = Column(Integer, nullable=False, default=0)
+    last_message_at = Column(DateTime(timezone=True), nullable=False)
+    last_message_preview = Column(String(255), nullable=False, default="")
+    last_sender = Column(String(16), nullable=False)
+    vendor_id = Column(String(255), nullable=True)
+    room_name = Column(String(255), nullable=True)
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+    )
+
+    __table_args__ = (
+        Index(
+            "idx_chat_sessions_last_message",
+            "last_message_at",
+            "session_id",
+        ),
+    )
+
+    def to_dict(self) -> dict[str, str | int | None]:
+        return {
+            "session_id": self.session_id,
+            "message_count": self.message_count,
+            "last_message_at": self.last_message_at.isoformat() if self.last_message_at else None,
+            "last_message_preview": self.last_message_preview,
+            "last_sender": self.last_sender,
+            "vendedor": self.vendor_id,
+            "nom_sala": self.room_name,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
@@ -1,7 +1,13 @@
 ﻿from __future__ import annotations
 
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from queue import Empty
-from datetime import datetime, timezone
+import base64
+import json
+import time
+from datetime import datetime, timedelta, timezone
 import uuid
 from urllib.parse import urlparse
 
@@ -16,12 +22,16 @@ from flask import (
     request,
     stream_with_context,
 )
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from sqlalchemy.exc import SQLAlchemyError
 
+from .circuit_breaker import webhook_breaker
 from .database import db_session
-from .models import ChatMessage
+from .group_commit import writer
+from .models import ChatMessage, ChatSession
+from .session_summary import record_session_activity
 from .sse import broker
+from .timing import annotate, phase
 
 
 api_bp = Blueprint("api", __name__)
@@ -30,6 +40,21 @@ pages_bp = Blueprint("pages", __name__)
 
 
 ALLOWED_WEBHOOK_HOSTS = {"n8n-n8n-webhook.jhbg9t.easypanel.host"}
+WEBHOOK_CONNECT_TIMEOUT = 1.0
+WEBHOOK_MAX_IN_FLIGHT = 8
+
+# Threads are only started on first use, i.e. inside each forked worker.
+_webhook_executor = ThreadPoolExecutor(
+    max_workers=WEBHOOK_MAX_IN_FLIGHT, thread_name_prefix="external-webhook"
+)
+
+
+class WebhookUnavailable(Exception):
+    """Raised instead of dispatching while the webhook circuit breaker is open."""
+
+    def __init__(self, retry_in_seconds: float | None) -> None:
+        super().__init__("External webhook circuit is open")
+        self.retry_in_seconds = retry_in_seconds
 
 
 def dispatch_external_webhook(
@@ -40,7 +65,7 @@ def dispatch_external_webhook(
 ) -> dict[str, str] | None:
     webhook_url = current_app.config.get("EXTERNAL_WEBHOOK_URL", "").strip()
     if not webhook_url:
-        current_app.logger.info("External webhook skipped: no URL configured")
+        current_app.logger.debug("External webhook skipped: no URL configured")
         return None
 
     parsed = urlparse(webhook_url)
@@ -58,7 +83,16 @@ def dispatch_external_webhook(
         payload["vendedor"] = vendor_id
     if room_name:
         payload["nom_sala"] = room_name
-    current_app.logger.info(
+
+    permit = webhook_breaker.allow_request()
+    if permit is None:
+        current_app.logger.debug(
+            "External webhook skipped for session=%s: circuit open", session_id
+        )
+        annotate(webhook="circuit_open")
+        raise WebhookUnavailable(webhook_breaker.snapshot()["retry_in_seconds"])
+
+    current_app.logger.debug(
         "Dispatching external webhook to %s for session=%s vendor=%s sala=%s",
         webhook_url,
         session_id,
@@ -66,25 +100,56 @@ def dispatch_external_webhook(
         room_name or "-",
     )
 
+    # httpx timeouts apply per step, so the call runs on a helper thread and
+    # the request thread waits on it for at most the remaining budget. A call
+    # that overruns keeps only a helper thread busy, never a gthread slot.
+    budget = current_app.config.get("WEBHOOK_LATENCY_BUDGET_MS", 3000) / 1000.0
+    started = time.monotonic()
+    deadline = started + budget
+    future = _webhook_executor.submit(
+        _post_external_webhook, webhook_url, payload, budget, deadline
+    )
     try:
-        with httpx.Client(timeout=5.0) as client:
-            response = client.post(
-                webhook_url, json=payload, follow_redirects=False
+        with phase("webhook"):
+            status_code, body = future.result(
+                timeout=max(deadline - time.monotonic(), 0.0)
             )
-            response.raise_for_status()
+    except FutureTimeoutError:
+        future.cancel()
+        webhook_breaker.record_failure(permit, time.monotonic() - started)
+        annotate(webhook="timeout")
+        current_app.logger.warning(
+            "External webhook exceeded its latency budget of %.1fs", budget
+        )
+        return None
     except httpx.HTTPError as exc:
-        current_app.logger.exception(
-            "External webhook request failed: %s", exc
+        elapsed = time.monotonic() - started
+        if _is_client_error(exc):
+            # The host answered promptly; a 404 for an unregistered workflow is
+            # a configuration problem, not a reason to stop calling it.
+            webhook_breaker.record_success(permit, elapsed)
+            annotate(webhook="rejected")
+        else:
+            webhook_breaker.record_failure(permit, elapsed)
+            annotate(webhook="failed")
+        current_app.logger.warning(
+            "External webhook request failed: %s",
+            exc,
+            exc_info=current_app.logger.isEnabledFor(logging.DEBUG),
         )
         return None
+    except Exception:
+        webhook_breaker.record_failure(permit, time.monotonic() - started)
+        raise
+    webhook_breaker.record_success(permit, time.monotonic() - started)
 
-    current_app.logger.info(
+    current_app.logger.debug(
         "External webhook responded with status %s",
-        response.status_code,
+        status_code,
     )
 
     try:
-        data = response.json()
+        data = json.loads(body)
     except ValueError:
         current_app.logger.warning("External webhook returned non JSON body")
         return None
@@ -94,11 +159,11 @@ def dispatch_external_webhook(
         ("message", "mensagem", "reply", "text", "conteudo", "content"),
     )
     if not reply_text:
-        current_app.logger.info("External webhook did not return reply text")
+        current_app.logger.debug("External webhook did not return reply text")
         return None
 
     if reply_text.lower() == "workflow was started":
-        current_app.logger.info("External webhook returned placeholder message; ignoring")
+        current_app.logger.debug("External webhook returned placeholder message; ignoring")
         return None
 
     raw_reply_session = _extract_nested_value(
@@ -107,7 +172,7 @@ def dispatch_external_webhook(
     ) or session_id
     reply_session = _normalize_uuid(raw_reply_session, session_id, label="session")
 
-    current_app.logger.info(
+    current_app.logger.debug(
         "External webhook produced reply for session=%s",
         reply_session,
     )
@@ -119,13 +184,41 @@ def dispatch_external_webhook(
 
 
 
+def _is_client_error(exc: httpx.HTTPError) -> bool:
+    if not isinstance(exc, httpx.HTTPStatusError):
+        return False
+    status = exc.response.status_code
+    # 408 and 429 mean the host is struggling, so they still trip the breaker.
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+def _post_external_webhook(
+    url: str, payload: dict[str, str], budget: float, deadline: float
+) -> tuple[int, bytes]:
+    timeout = httpx.Timeout(budget, connect=min(WEBHOOK_CONNECT_TIMEOUT, budget))
+    with httpx.Client(timeout=timeout) as client:
+        with client.stream("POST", url, json=payload, follow_redirects=False) as response:
+            response.raise_for_status()
+            body = bytearray()
+            # Stop reading a slowly dripping body once nobody waits for it.
+            for chunk in response.iter_bytes():
+                body.extend(chunk)
+                if time.monotonic() > deadline:
+                    raise httpx.ReadTimeout(
+                        "External webhook exceeded its latency budget",
+                        request=response.request,
+                    )
+            return response.status_code, bytes(body)
+
+
+
 def _normalize_uuid(value: str, fallback: str, *, label: str) -> str:
     try:
         uuid.UUID(value)
         return value
     except (ValueError, AttributeError, TypeError):
         if value and value != fallback:
-            current_app.logger.info(
+            current_app.logger.debug(
                 "External webhook reply %s value '%s' is invalid; using fallback",
                 label,
                 value,
@@ -167,6 +260,19 @@ def _pick_payload_value(payload: object, *keys: str) -> str:
     return candidate if candidate else ""
 
 
+def _explicit_payload_value(payload: object, *keys: str) -> str | None:
+    if not isinstance(payload, dict):
+        return None
+    for key in keys:
+        value = payload.get(key)
+        if value is None or isinstance(value, (dict, list, tuple)):
+            continue
+        candidate = str(value).strip()
+        if candidate:
+            return candidate
+    return None
+
+
 def _extract_nested_value(payload: object, keys: tuple[str, ...]) -> str:
     if isinstance(payload, str):
         candidate = payload.strip()
@@ -198,6 +304,42 @@ def _extract_nested_value(payload: object, keys: tuple[str, ...]) -> str:
     return candidate if candidate else ""
 
 
+def _persist_messages(
+    *records: ChatMessage,
+    vendor_id: str | None = None,
+    room_name: str | None = None,
+) -> list[dict[str, str | bool]]:
+    """Store ``records`` and their session summaries in one transaction and
+    publish the non-user ones."""
+    if writer.enabled:
+        # The writer publishes after its batch commits, so both land in "db".
+        with phase("db"):
+            return writer.submit(records, vendor_id=vendor_id, room_name=room_name)
+
+    with phase("db"):
+        db_session.add_all(records)
+        db_session.flush()
+        record_session_activity(
+            db_session, records, vendor_id=vendor_id, room_name=room_name
+        )
+        db_session.commit()
+        stored = [record.to_dict() for record in records]
+    with phase("publish"):
+        for message in stored:
+            if not message["is_from_user"]:
+                broker.publish(message)
+    return stored
+
+
+def _sse_fallback_overlap() -> timedelta:
+    """How far back the SSE fallback re-reads to catch late-committed rows."""
+    # A deferred user message can be written up to one webhook budget plus one
+    # group-commit wait after its ``created_at``.
+    budget_ms = current_app.config.get("WEBHOOK_LATENCY_BUDGET_MS", 3000)
+    commit_ms = current_app.config.get("GROUP_COMMIT_TIMEOUT_MS", 5000)
+    return timedelta(milliseconds=budget_ms + commit_ms) + timedelta(seconds=1)
+
+
 @pages_bp.route("/")
 def index() -> str:
     return render_template(
@@ -208,7 +350,7 @@ def index() -> str:
 
 @api_bp.route("/health", methods=["GET"])
 def healthcheck() -> Response:
-    return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", "external_webhook": webhook_breaker.snapshot()})
 
 
 @api_bp.route("/api/messages", methods=["GET"])
@@ -228,6 +370,71 @@ def list_messages() -> Response:
     return jsonify({"messages": messages})
 
 
+SESSIONS_PAGE_SIZE = 50
+SESSIONS_MAX_PAGE_SIZE = 200
+
+
+def _encode_sessions_cursor(summary: ChatSession) -> str:
+    raw = f"{summary.last_message_at.isoformat()}|{summary.session_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_sessions_cursor(cursor: str) -> tuple[datetime, str] | None:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        timestamp, separator, session_id = raw.partition("|")
+        if not separator or not session_id:
+            return None
+        return datetime.fromisoformat(timestamp), session_id
+    except ValueError:
+        return None
+
+
+@api_bp.route("/api/sessions", methods=["GET"])
+def list_sessions() -> Response:
+    provided_key = (
+        request.headers.get("x-api-key")
+        or (request.headers.get("authorization") or "").replace("Bearer ", "")
+    )
+    service_key = current_app.config.get("SERVICE_API_KEY")
+    if not service_key or provided_key != service_key:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    try:
+        limit = int(request.args.get("limit", SESSIONS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid limit parameter"}), 400
+    limit = max(1, min(limit, SESSIONS_MAX_PAGE_SIZE))
+
+    # Keyset pagination over idx_chat_sessions_last_message, newest first.
+    stmt = select(ChatSession).order_by(
+        ChatSession.last_message_at.desc(), ChatSession.session_id.desc()
+    )
+    cursor = request.args.get("cursor")
+    if cursor:
+        decoded = _decode_sessions_cursor(cursor)
+        if decoded is None:
+            return jsonify({"error": "Invalid cursor parameter"}), 400
+        last_message_at, session_id = decoded
+        stmt = stmt.where(
+            tuple_(ChatSession.last_message_at, ChatSession.session_id)
+            < tuple_(last_message_at, session_id)
+        )
+
+    with phase("db"):
+        summaries = db_session.execute(stmt.limit(limit + 1)).scalars().all()
+
+    has_more = len(summaries) > limit
+    summaries = summaries[:limit]
+    next_cursor = _encode_sessions_cursor(summaries[-1]) if has_more else None
+    return jsonify(
+        {
+            "sessions": [summary.to_dict() for summary in summaries],
+            "next_cursor": next_cursor,
+        }
+    )
+
+
 @api_bp.route("/api/messages/stream", methods=["GET"])
 def stream_messages() -> Response:
     session_id = request.args.get("sessao") or request.args.get("session_id")
@@ -236,8 +443,10 @@ def stream_messages() -> Response:
         return jsonify({"error": "Missing sessao parameter"}), 400
 
     queue = broker.subscribe(session_id)
-    last_seen_at = datetime.now(timezone.utc)
+    stream_started_at = datetime.now(timezone.utc)
+    last_seen_at = stream_started_at
     seen_ids: set[str] = set()
+    overlap = _sse_fallback_overlap()
 
     def event_stream():
         nonlocal last_seen_at
@@ -262,31 +471,36 @@ def stream_messages() -> Response:
                     yield broker.format_sse(message)
                 except Empty:
                     try:
+                        # Rows can be committed after newer ones (a user message
+                        # keeps its receipt time while its webhook call runs), so
+                        # re-read an overlap window and rely on seen_ids to dedupe.
+                        since = max(last_seen_at - overlap, stream_started_at)
                         stmt = (
                             select(ChatMessage)
                             .where(
                                 ChatMessage.session_id == session_id,
-                                ChatMessage.created_at > last_seen_at,
+                                ChatMessage.created_at > since,
                             )
                             .order_by(ChatMessage.created_at.asc())
                         )
                         new_messages = (
                             db_session.execute(stmt).scalars().all()
                         )
-                        if new_messages:
-                            for db_message in new_messages:
-                                message_dict = db_message.to_dict()
-                                message_id = str(message_dict.get("id") or "")
-                                if message_id and message_id in seen_ids:
-                                    continue
-                                if message_id:
-                                    seen_ids.add(message_id)
-                                last_seen_at = max(
-                                    last_seen_at,
-                                    db_message.created_at or last_seen_at,
-                                )
-                                yield broker.format_sse(message_dict)
-                        else:
+                        sent = False
+                        for db_message in new_messages:
+                            message_dict = db_message.to_dict()
+                            message_id = str(message_dict.get("id") or "")
+                            if message_id and message_id in seen_ids:
+                                continue
+                            if message_id:
+                                seen_ids.add(message_id)
+                            last_seen_at = max(
+                                last_seen_at,
+                                db_message.created_at or last_seen_at,
+                            )
+                            sent = True
+                            yield broker.format_sse(message_dict)
+                        if not sent:
                             yield ": keep-alive\n\n"
                     except SQLAlchemyError:
                         db_session.rollback()
@@ -305,18 +519,24 @@ def stream_messages() -> Response:
 
 @api_bp.route("/functions/v1/webhook-valezap", methods=["POST"])
 def webhook_valezap() -> Response:
-    payload = request.get_json(silent=True) or {}
-    current_app.logger.info(
-        "Webhook request received with keys=%s",
-        sorted(payload.keys()) if isinstance(payload, dict) else type(payload),
-    )
-
-    sessao = _pick_payload_value(payload, "sessao", "session", "session_id")
-    mensagem = _pick_payload_value(payload, "mensagem", "message", "content", "texto")
-    vendedor = _pick_payload_value(payload, "vendedor", "vendor")
-    nome_sala = _pick_payload_value(payload, "nom_sala", "nome_sala", "sala")
+    with phase("extract"):
+        payload = request.get_json(silent=True) or {}
+        current_app.logger.debug(
+            "Webhook request received with keys=%s",
+            sorted(payload.keys()) if isinstance(payload, dict) else type(payload),
+        )
 
-    current_app.logger.info(
+        sessao = _pick_payload_value(payload, "sessao", "session", "session_id")
+        mensagem = _pick_payload_value(payload, "mensagem", "message", "content", "texto")
+        vendedor = _pick_payload_value(payload, "vendedor", "vendor")
+        nome_sala = _pick_payload_value(payload, "nom_sala", "nome_sala", "sala")
+        # ``_pick_payload_value`` falls back to any string in the payload, which
+        # must not leak into the session summary.
+        summary_vendor = _explicit_payload_value(payload, "vendedor", "vendor")
+        summary_room = _explicit_payload_value(payload, "nom_sala", "nome_sala", "sala")
+    annotate(session=sessao or None)
+
+    current_app.logger.debug(
         "Webhook payload parsed: session=%s vendor=%s sala=%s message_length=%s",
         sessao or "-",
         vendedor or "-",
@@ -363,21 +583,22 @@ def webhook_valezap() -> Response:
         payload.pop("service-token", None)
         payload.pop("serviceToken", None)
 
-    current_app.logger.info(
+    current_app.logger.debug(
         "Webhook authentication evaluated: service_mode=%s (header=%s body_token=%s)",
         is_service_request,
         bool(provided_key and provided_key == service_key),
         bool(body_service_key),
     )
 
+    annotate(service_mode=is_service_request)
     if not is_service_request:
-        current_app.logger.info(
+        current_app.logger.debug(
             "Webhook treated as user workflow; awaiting external reply"
         )
 
     try:
         if is_service_request:
-            current_app.logger.info(
+            current_app.logger.debug(
                 "Persisting service message for session=%s",
                 sessao,
             )
@@ -386,49 +607,97 @@ def webhook_valezap() -> Response:
                 message=mensagem,
                 is_from_user=False,
             )
-            db_session.add(message_record)
-            db_session.commit()
-            message_dict = message_record.to_dict()
-            broker.publish(message_dict)
-            current_app.logger.info(
+            (message_dict,) = _persist_messages(message_record)
+            current_app.logger.debug(
                 "Service message published id=%s", message_dict.get("id")
             )
             return jsonify({"success": True, "data": message_dict}), 200
 
-        current_app.logger.info(
-            "Persisting user message for session=%s",
-            sessao,
-        )
         user_message = ChatMessage(
+            id=uuid.uuid4(),
             session_id=sessao,
             message=mensagem,
             is_from_user=True,
-        )
-        db_session.add(user_message)
-        db_session.commit()
-        user_dict = user_message.to_dict()
-        current_app.logger.info(
-            "User message stored id=%s; evaluating auto-reply pipeline",
-            user_dict.get("id"),
+            created_at=datetime.now(timezone.utc),
         )
 
         auto_reply_mode = (
             current_app.config.get("AUTO_REPLY_MODE", "").strip().lower()
         )
-        reply_data: dict[str, str] | None = None
+        expects_reply = auto_reply_mode in {"webhook", "external"}
+        user_dict: dict[str, str | bool] | None = None
+        bot_dict: dict[str, str | bool] | None = None
+
+        if not expects_reply:
+            # Nothing to share a transaction with, so store the message before
+            # the dispatch and it survives a slow or failed webhook.
+            (user_dict,) = _persist_messages(
+                user_message,
+                vendor_id=summary_vendor,
+                room_name=summary_room,
+            )
+        current_app.logger.debug(
+            "User message received id=%s; evaluating auto-reply pipeline",
+            user_message.id,
+        )
 
-        if auto_reply_mode in {"webhook", "external"}:
-            current_app.logger.info(
-                "Auto-reply mode '%s' enabled; forwarding message to external webhook",
-                auto_reply_mode,
+        reply_data: dict[str, str] | None = None
+        webhook_unavailable: WebhookUnavailable | None = None
+        try:
+            if expects_reply:
+                current_app.logger.debug(
+                    "Auto-reply mode '%s' enabled; forwarding message to external webhook",
+                    auto_reply_mode,
+                )
+                reply_data = dispatch_external_webhook(
+                    sessao, mensagem, vendedor, nome_sala
+                )
+            else:
+                current_app.logger.debug(
+                    "Auto-reply disabled (mode=%s); forwarding webhook without rendering reply",
+                    auto_reply_mode or "unset",
+                )
+                dispatch_external_webhook(sessao, mensagem, vendedor, nome_sala)
+        except WebhookUnavailable as exc:
+            webhook_unavailable = exc
+        except Exception:  # noqa: BLE001 - the user message must still be stored
+            current_app.logger.exception(
+                "External webhook dispatch failed for session=%s", sessao
             )
-            reply_data = dispatch_external_webhook(sessao, mensagem, vendedor, nome_sala)
-        else:
+            reply_data = None
+
+        if expects_reply:
+            # The user message and its reply share one transaction. The user
+            # message keeps its receipt time; the SSE fallback re-reads an
+            # overlap window so the late write is still delivered.
+            records = [user_message]
+            if reply_data:
+                current_app.logger.debug(
+                    "Reply received from external webhook for session=%s",
+                    reply_data["session_id"],
+                )
+                records.append(
+                    ChatMessage(
+                        session_id=reply_data["session_id"],
+                        message=reply_data["message"],
+                        is_from_user=False,
+                    )
+                )
+            else:
+                current_app.logger.debug("External webhook returned no reply")
+
             current_app.logger.debug(
-                "Auto-reply disabled (mode=%s); forwarding webhook without rendering reply",
-                auto_reply_mode or "unset",
+                "Persisting user message for session=%s (with_reply=%s)",
+                sessao,
+                len(records) > 1,
             )
-            dispatch_external_webhook(sessao, mensagem, vendedor, nome_sala)
+            stored = _persist_messages(
+                *records,
+                vendor_id=summary_vendor,
+                room_name=summary_room,
+            )
+            user_dict = stored[0]
+            bot_dict = stored[1] if len(stored) > 1 else None
 
         response_payload: dict[str, object] = {
             "sessao": sessao,
@@ -440,28 +709,19 @@ def webhook_valezap() -> Response:
         if nome_sala:
             response_payload["nom_sala"] = nome_sala
         status_code = 202
-
-        if reply_data:
-            current_app.logger.info(
-                "Reply received from external webhook for session=%s",
-                reply_data["session_id"],
-            )
-            reply_message = ChatMessage(
-                session_id=reply_data["session_id"],
-                message=reply_data["message"],
-                is_from_user=False,
-            )
-            db_session.add(reply_message)
-            db_session.commit()
-            bot_dict = reply_message.to_dict()
-            broker.publish(bot_dict)
+        if webhook_unavailable is not None:
+            # The message is stored but n8n never saw it; tell the caller so it
+            # can resend later instead of assuming it was delivered.
+            response_payload["webhook"] = "circuit_open"
+            response_payload["retry_in_seconds"] = webhook_unavailable.retry_in_seconds
+
+        annotate(has_reply=bot_dict is not None)
+        if bot_dict:
             response_payload["reply"] = bot_dict
             status_code = 200
-            current_app.logger.info(
+            current_app.logger.debug(
                 "Reply stored and published id=%s", bot_dict.get("id")
             )
-        else:
-            current_app.logger.info("External webhook returned no reply")
 
         return jsonify({"success": True, "data": response_payload}), status_code
 
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from typing import Any, Iterable, Sequence
+
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .models import ChatMessage, ChatSession
+
+
+PREVIEW_LENGTH = 140
+
+# Messages inserted together plus the vendor/room they arrived with.
+ActivityUnit = tuple[Sequence[ChatMessage], str | None, str | None]
+
+_UPSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def _preview(message: str) -> str:
+    text = " ".join(message.split())
+    if len(text) <= PREVIEW_LENGTH:
+        return text
+    return text[: PREVIEW_LENGTH - 1] + "…"
+
+
+def _summarize(units: Iterable[ActivityUnit]) -> list[dict[str, Any]]:
+    summaries: dict[str, dict[str, Any]] = {}
+    for messages, vendor_id, room_name in units:
+        for message in messages:
+            entry = summaries.get(message.session_id)
+            if entry is None:
+                entry = summaries[message.session_id] = {
+                    "session_id": message.session_id,
+                    "message_count": 0,
+                    "last_message_at": None,
+                    "vendor_id": None,
+                    "room_name": None,
+                    "created_at": message.created_at,
+                }
+            entry["message_count"] += 1
+            entry["vendor_id"] = vendor_id or entry["vendor_id"]
+            entry["room_name"] = room_name or entry["room_name"]
+            if entry["last_message_at"] is None or message.created_at >= entry["last_message_at"]:
+                entry["last_message_at"] = message.created_at
+                entry["last_message_preview"] = _preview(message.message)
+                entry["last_sender"] = "user" if message.is_from_user else "bot"
+    # Fixed lock order so concurrent upserts touching several sessions cannot deadlock.
+    return [summaries[key] for key in sorted(summaries)]
+
+
+def record_session_activity(
+    session: Session,
+    messages: Sequence[ChatMessage],
+    *,
+    vendor_id: str | None = None,
+    room_name: str | None = None,
+) -> None:
+    """Fold flushed ``messages`` into their ``chat_sessions`` rows.
+
+    Must run inside the transaction that inserts the messages so the summary
+    never drifts from ``chat_messages``.
+    """
+    record_batch_activity(session, [(messages, vendor_id, room_name)])
+
+
+def record_batch_activity(session: Session, units: Iterable[ActivityUnit]) -> None:
+    """Like :func:`record_session_activity` for several units at once, issuing
+    a single upsert for the whole batch."""
+    rows = _summarize(units)
+    if not rows:
+        return
+
+    upsert = _UPSERTS.get(session.get_bind().dialect.name)
+    if upsert is None:
+        _record_with_orm(session, rows)
+        return
+
+    table = ChatSession.__table__
+    stmt = upsert(table).values(rows)
+    excluded = stmt.excluded
+    is_newer = excluded.last_message_at >= table.c.last_message_at
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.session_id],
+        set_={
+            "message_count": table.c.message_count + excluded.message_count,
+            "last_message_at": case(
+                (is_newer, excluded.last_message_at), else_=table.c.last_message_at
+            ),
+            "last_message_preview": case(
+                (is_newer, excluded.last_message_preview),
+                else_=table.c.last_message_preview,
+            ),
+            "last_sender": case(
+                (is_newer, excluded.last_sender), else_=table.c.last_sender
+            ),
+            "vendor_id": func.coalesce(excluded.vendor_id, table.c.vendor_id),
+            "room_name": func.coalesce(excluded.room_name, table.c.room_name),
+        },
+    )
+    session.execute(stmt)
+
+
+def _record_with_orm(session: Session, rows: list[dict[str, Any]]) -> None:
+    for row in rows:
+        summary = session.get(ChatSession, row["session_id"], with_for_update=True)
+        if summary is None:
+            session.add(ChatSession(**row))
+            continue
+        summary.message_count += row["message_count"]
+        if row["last_message_at"] >= summary.last_message_at:
+            summary.last_message_at = row["last_message_at"]
+            summary.last_message_preview = row["last_message_preview"]
+            summary.last_sender = row["last_sender"]
+        summary.vendor_id = row["vendor_id"] or summary.vendor_id
+        summary.room_name = row["room_name"] or summary.room_name
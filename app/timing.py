@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Iterator
+
+from flask import Flask, Response, current_app, g, has_request_context, request
+
+
+class RequestTimings:
+    """Accumulates per-phase durations (in milliseconds) for one request."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.fields: dict[str, object] = {}
+        self.status: int | None = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        entries = [f"{name};dur={duration:.1f}" for name, duration in self.phases.items()]
+        entries.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(entries)
+
+
+def phase(name: str) -> ContextManager[None]:
+    """Time a block as ``name`` for the current request, if there is one."""
+    timings = g.get("request_timings") if has_request_context() else None
+    if timings is None:
+        return nullcontext()
+    return timings.phase(name)
+
+
+def annotate(**fields: object) -> None:
+    """Attach extra fields to the current request's summary log line."""
+    timings = g.get("request_timings") if has_request_context() else None
+    if timings is not None:
+        timings.fields.update(fields)
+
+
+def init_request_timing(app: Flask) -> None:
+    @app.before_request
+    def start_request_timing() -> None:
+        g.request_timings = RequestTimings()
+
+    @app.after_request
+    def add_server_timing(response: Response) -> Response:
+        timings: RequestTimings | None = g.get("request_timings")
+        if timings is not None and request.endpoint != "static":
+            response.headers["Server-Timing"] = timings.server_timing(timings.total_ms())
+            timings.status = response.status_code
+        return response
+
+    # after_request hooks are skipped when a view raises, so the summary line is
+    # written on teardown, which runs for failed requests too.
+    @app.teardown_request
+    def log_request_timing(exception: BaseException | None = None) -> None:
+        timings: RequestTimings | None = g.pop("request_timings", None)
+        if timings is None or request.endpoint == "static":
+            return
+
+        status = timings.status
+        if exception is not None and status is None:
+            status = 500
+        summary: dict[str, object] = {
+            "method": request.method,
+            "path": request.path,
+            "status": status,
+            "total_ms": round(timings.total_ms(), 1),
+            "phases_ms": {name: round(value, 1) for name, value in timings.phases.items()},
+        }
+        if exception is not None:
+            summary["error"] = type(exception).__name__
+        summary.update(timings.fields)
+        current_app.logger.info("request %s", json.dumps(summary, ensure_ascii=False))
@@ -0,0 +1,59 @@
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    session_id VARCHAR(255) PRIMARY KEY,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_message_at TIMESTAMPTZ NOT NULL,
+    last_message_preview VARCHAR(255) NOT NULL DEFAULT '',
+    last_sender VARCHAR(16) NOT NULL,
+    vendor_id VARCHAR(255),
+    room_name VARCHAR(255),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_last_message
+    ON chat_sessions (last_message_at, session_id);
+
+-- Backfill from existing history. The app may already have created the table
+-- (init_db) and upserted rows that only count messages received since then, so
+-- existing rows are recomputed from chat_messages as well; vendor_id/room_name
+-- are left as the webhook recorded them.
+--
+-- The SHARE lock waits for in-flight inserts to commit and blocks new ones
+-- until COMMIT. The recomputed values therefore match chat_messages exactly,
+-- and no concurrent webhook upsert can be overwritten with stale numbers.
+BEGIN;
+
+LOCK TABLE chat_messages IN SHARE MODE;
+
+INSERT INTO chat_sessions (
+    session_id,
+    message_count,
+    last_message_at,
+    last_message_preview,
+    last_sender,
+    created_at
+)
+SELECT
+    stats.session_id,
+    stats.message_count,
+    latest.created_at,
+    LEFT(REGEXP_REPLACE(latest.message, '\s+', ' ', 'g'), 140),
+    CASE WHEN latest.is_from_user THEN 'user' ELSE 'bot' END,
+    stats.first_message_at
+FROM (
+    SELECT session_id, COUNT(*) AS message_count, MIN(created_at) AS first_message_at
+    FROM chat_messages
+    GROUP BY session_id
+) AS stats
+JOIN (
+    SELECT DISTINCT ON (session_id) session_id, message, is_from_user, created_at
+    FROM chat_messages
+    ORDER BY session_id, created_at DESC
+) AS latest ON latest.session_id = stats.session_id
+ON CONFLICT (session_id) DO UPDATE SET
+    message_count = EXCLUDED.message_count,
+    last_message_at = EXCLUDED.last_message_at,
+    last_message_preview = EXCLUDED.last_message_preview,
+    last_sender = EXCLUDED.last_sender,
+    created_at = EXCLUDED.created_at;
+
+COMMIT;